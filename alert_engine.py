@@ -0,0 +1,558 @@
+"""Incremental rule-based alert engine over live vehicle and stop state.
+
+Each call to ``AlertEngine.update`` is one state tick. Rules are indexed by
+route and stop and declare the fields they read, so a tick only re-runs the
+rules whose inputs actually changed. Time-based conditions (missing vehicles,
+headway gaps, debounce windows) are re-checked from a wake-up heap instead of
+rescanning the whole network on every tick.
+"""
+import heapq
+import itertools
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+SEVERITY_ORDER = {'high': 0, 'medium': 1, 'low': 2}
+# How often the value of an active time-based alert (a growing gap) is refreshed
+REFRESH_INTERVAL = timedelta(minutes=1)
+
+
+def trip_finished(vehicle, now):
+    """Whether a vehicle is at its last scheduled stop or past its trip end"""
+    last_stop_id = vehicle.get('last_stop_id')
+    if last_stop_id is not None and vehicle.get('stop_id') == last_stop_id:
+        return True
+    trip_end = vehicle.get('trip_end')
+    return trip_end is not None and now >= trip_end
+
+
+class _Context(dict):
+    """Format context that leaves unknown placeholders readable"""
+
+    def __missing__(self, key):
+        return '?'
+
+
+class Rule:
+    """Base class for alert rules"""
+    kind = None
+    scope = 'vehicle'  # 'vehicle', 'missing', 'headway' or 'stop'
+    inputs = ()
+    message = '{kind}: {value}'
+
+    def __init__(self, rule_id, threshold, severity='medium', route_id=None,
+                 stop_id=None, message=None, hold_seconds=0, clear_seconds=0):
+        if severity not in SEVERITY_ORDER:
+            raise ValueError(f"Unknown severity: {severity}")
+        self.rule_id = str(rule_id)
+        self.threshold = threshold
+        self.severity = severity
+        self.route_id = str(route_id) if route_id is not None else None
+        self.stop_id = str(stop_id) if stop_id is not None else None
+        self.hold = timedelta(seconds=hold_seconds)
+        self.clear = timedelta(seconds=clear_seconds)
+        if message is not None:
+            self.message = message
+        # Filtered rules must also wake up when the vehicle leaves their route/stop
+        self.inputs = tuple(self.inputs) + tuple(
+            field for field, value in (('route_id', self.route_id), ('stop_id', self.stop_id))
+            if value is not None
+        )
+
+    def applies(self, route_id, stop_id):
+        return ((self.route_id is None or self.route_id == route_id) and
+                (self.stop_id is None or self.stop_id == stop_id))
+
+    def check(self, subject, engine, now):
+        """Return the measured value if the rule is violated, else None"""
+        raise NotImplementedError
+
+    def wake_at(self, subject, engine, now):
+        """Return when a time-based condition has to be re-checked, if ever"""
+        return None
+
+    def format(self, context, value):
+        context = _Context(context, kind=self.kind, value=value, threshold=self.threshold)
+        return self.message.format_map(context)
+
+
+class DelayRule(Rule):
+    """Vehicle delay at or above ``threshold`` minutes"""
+    kind = 'delay'
+    inputs = ('delay_minutes',)
+    message = 'Delay on route {route_name}: {value} min at {current_stop}'
+
+    def check(self, subject, engine, now):
+        vehicle = engine.vehicles.get(subject)
+        if vehicle is None or not self.applies(vehicle.get('route_id'), vehicle.get('stop_id')):
+            return None
+        delay = vehicle.get('delay_minutes')
+        if delay is None or delay < self.threshold:
+            return None
+        return delay
+
+
+class VehicleLoadRule(Rule):
+    """Vehicle occupancy at or above ``threshold`` percent of capacity"""
+    kind = 'vehicle_load'
+    inputs = ('passengers', 'capacity')
+    message = 'Vehicle on route {route_name} at {value:.0f}% capacity'
+
+    def check(self, subject, engine, now):
+        vehicle = engine.vehicles.get(subject)
+        if vehicle is None or not self.applies(vehicle.get('route_id'), vehicle.get('stop_id')):
+            return None
+        passengers, capacity = vehicle.get('passengers'), vehicle.get('capacity')
+        if passengers is None or not capacity:
+            return None
+        load = passengers / capacity * 100
+        return load if load >= self.threshold else None
+
+
+class MissingVehicleRule(Rule):
+    """Vehicle absent from the feed for ``threshold`` minutes"""
+    kind = 'missing_vehicle'
+    scope = 'missing'
+    message = 'Vehicle on route {route_name} missing from feed for {value:.0f} min'
+
+    def check(self, subject, engine, now):
+        vehicle = engine.absent.get(subject)
+        if vehicle is None or not self.applies(vehicle.get('route_id'), vehicle.get('stop_id')):
+            return None
+        # A trip whose scheduled end has passed is no longer expected in the feed
+        if trip_finished(vehicle, now):
+            return None
+        gap = (now - engine.last_seen[subject]).total_seconds() / 60
+        return gap if gap >= self.threshold else None
+
+    def wake_at(self, subject, engine, now):
+        vehicle = engine.absent.get(subject)
+        if vehicle is None:
+            return None
+        due = engine.last_seen[subject] + timedelta(minutes=self.threshold)
+        wake = due if due > now else now + REFRESH_INTERVAL
+        trip_end = vehicle.get('trip_end')
+        if trip_end is not None and now < trip_end < wake:
+            wake = trip_end
+        return wake
+
+
+class HeadwayRule(Rule):
+    """No vehicle of a route arrived at a stop for ``threshold`` minutes"""
+    kind = 'headway_gap'
+    scope = 'headway'
+    message = 'Headway gap on route {route_name} at {stop_name}: {value:.0f} min'
+
+    def check(self, subject, engine, now):
+        last = engine.arrivals.get(subject)
+        if last is None or not self.applies(*subject):
+            return None
+        # No gap is expected once the route's last scheduled trip is over
+        service_end = engine.service_ends.get(subject[0])
+        if service_end is not None and now >= service_end:
+            return None
+        gap = (now - last).total_seconds() / 60
+        return gap if gap >= self.threshold else None
+
+    def wake_at(self, subject, engine, now):
+        last = engine.arrivals.get(subject)
+        if last is None:
+            return None
+        due = last + timedelta(minutes=self.threshold)
+        wake = due if due > now else now + REFRESH_INTERVAL
+        service_end = engine.service_ends.get(subject[0])
+        if service_end is not None and now < service_end < wake:
+            wake = service_end
+        return wake
+
+
+class StopOvercrowdingRule(Rule):
+    """Stop load at or above ``threshold`` percent of capacity"""
+    kind = 'stop_overcrowding'
+    scope = 'stop'
+    inputs = ('current_load', 'capacity')
+    message = 'Overcrowding at {stop_name}: {value:.0f}% capacity'
+
+    def check(self, subject, engine, now):
+        stop = engine.stop_loads.get(subject)
+        if stop is None or not self.applies(None, subject):
+            return None
+        load, capacity = stop.get('current_load'), stop.get('capacity')
+        if load is None or not capacity:
+            return None
+        percentage = load / capacity * 100
+        return percentage if percentage >= self.threshold else None
+
+    def applies(self, route_id, stop_id):
+        # Stop loads are not tied to a route
+        return self.stop_id is None or self.stop_id == stop_id
+
+
+RULE_TYPES = {
+    rule.kind: rule
+    for rule in (DelayRule, VehicleLoadRule, MissingVehicleRule, HeadwayRule, StopOvercrowdingRule)
+}
+
+DEFAULT_RULES = [
+    {'id': 'delay-medium', 'type': 'delay', 'threshold': 5, 'severity': 'medium', 'hold_seconds': 30},
+    {'id': 'delay-high', 'type': 'delay', 'threshold': 10, 'severity': 'high', 'hold_seconds': 30},
+    {'id': 'vehicle-full', 'type': 'vehicle_load', 'threshold': 95, 'severity': 'low', 'hold_seconds': 60},
+    {'id': 'missing-vehicle', 'type': 'missing_vehicle', 'threshold': 3, 'severity': 'medium'},
+    {'id': 'headway-gap', 'type': 'headway_gap', 'threshold': 20, 'severity': 'medium'},
+    {'id': 'stop-overcrowding', 'type': 'stop_overcrowding', 'threshold': 90, 'severity': 'high',
+     'hold_seconds': 60, 'clear_seconds': 60},
+]
+
+
+def rules_from_config(config):
+    """Build rule objects from a list of rule dicts"""
+    rules = []
+    for entry in config:
+        entry = dict(entry)
+        rule_type = entry.pop('type')
+        if rule_type not in RULE_TYPES:
+            raise ValueError(f"Unknown rule type: {rule_type}")
+        rule_id = entry.pop('id', f"{rule_type}-{len(rules) + 1}")
+        rules.append(RULE_TYPES[rule_type](rule_id, **entry))
+    return rules
+
+
+def load_rules(path):
+    """Load rule definitions from a JSON file"""
+    with open(path, encoding='utf-8') as f:
+        return rules_from_config(json.load(f))
+
+
+class AlertEngine:
+    """Evaluates alert rules incrementally on every state tick"""
+
+    def __init__(self, rules=None, key_field='trip_id', forget_minutes=30, max_alert_minutes=60):
+        self.key_field = key_field
+        # Stale vehicles and headway clocks are dropped ``forget_minutes`` after the
+        # longest missing/headway threshold, so every threshold can still fire
+        self._forget_margin = timedelta(minutes=forget_minutes)
+        self.forget = self._forget_margin
+        # Subjects that are still alerting get at most ``max_alert_minutes`` on top of that
+        self._alert_cap = timedelta(minutes=max_alert_minutes)
+        # route_id -> end of the route's last scheduled trip today
+        self.service_ends = {}
+        self.rules = {}
+        # scope -> ('route', route_id) or ('stop', stop_id) -> rules; None holds network-wide rules.
+        # Rules filtered by route are filed under the route, stop-only rules under the stop
+        self._index = {'vehicle': {}, 'missing': {}, 'headway': {}, 'stop': {}}
+
+        self.vehicles = {}
+        self.absent = {}
+        self.last_seen = {}
+        self.arrivals = {}
+        self.stop_loads = {}
+        self._route_names = {}
+        self._stop_names = {}
+
+        self._states = {}
+        self._active = {}
+        self._wakeups = []
+        self._scheduled = {}
+        self._seq = itertools.count()
+        self._alert_ids = itertools.count(1)
+        self.last_tick = {'evaluated': 0, 'duration_ms': 0.0, 'timestamp': None}
+        # The apps share one engine across request threads; each tick is applied as a unit
+        self._lock = threading.Lock()
+
+        for rule in rules_from_config(DEFAULT_RULES) if rules is None else rules:
+            self.add_rule(rule)
+
+    def add_rule(self, rule):
+        with self._lock:
+            if rule.rule_id in self.rules:
+                raise ValueError(f"Duplicate rule id: {rule.rule_id}")
+            self.rules[rule.rule_id] = rule
+            if rule.route_id is not None and rule.scope != 'stop':
+                key = ('route', rule.route_id)
+            elif rule.stop_id is not None:
+                key = ('stop', rule.stop_id)
+            else:
+                key = None
+            self._index[rule.scope].setdefault(key, []).append(rule)
+            if rule.scope in ('missing', 'headway'):
+                self.forget = max(self.forget, timedelta(minutes=rule.threshold) + self._forget_margin)
+
+    def set_service_ends(self, service_ends):
+        """Set when each route's last scheduled trip ends; its headway clocks stop there"""
+        with self._lock:
+            self.service_ends = dict(service_ends)
+
+    def _candidates(self, scope, route_ids=(), stop_ids=()):
+        index = self._index[scope]
+        rules = list(index.get(None, ()))
+        for kind, keys in (('route', route_ids), ('stop', stop_ids)):
+            for key in set(keys):
+                if key is not None:
+                    rules.extend(index.get((kind, key), ()))
+        return rules
+
+    def update(self, vehicles=(), stop_loads=None, now=None):
+        """Apply one state tick and return the current alerts
+
+        ``vehicles`` is the full live vehicle feed. Vehicles may carry
+        ``last_stop_id`` and ``trip_end`` (a datetime) so that trips leaving
+        the feed after finishing their run are not reported as missing.
+        ``stop_loads`` is an optional full snapshot of stop loads; when
+        omitted, stop state is left untouched.
+        """
+        with self._lock:
+            now = now or datetime.now()
+            started = time.perf_counter()
+            evaluated = 0
+
+            seen = {}
+            for vehicle in vehicles:
+                key = vehicle.get(self.key_field)
+                if key is not None:
+                    # Snapshot, so callers mutating their dicts in place still register as changes
+                    seen[str(key)] = dict(vehicle)
+
+            for key, vehicle in seen.items():
+                evaluated += self._apply_vehicle(key, vehicle, now)
+            for key in [key for key in self.vehicles if key not in seen]:
+                evaluated += self._drop_vehicle(key, now)
+
+            if stop_loads is not None:
+                evaluated += self._apply_stop_loads(stop_loads, now)
+
+            evaluated += self._run_wakeups(now)
+
+            self.last_tick = {
+                'evaluated': evaluated,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+                'timestamp': now,
+            }
+            return self._alerts()
+
+    def _apply_vehicle(self, key, vehicle, now):
+        evaluated = 0
+        previous = self.vehicles.get(key)
+        reappeared = self.absent.pop(key, None)
+        if previous is None:
+            previous = reappeared
+            changed = None
+        else:
+            changed = {field for field in set(vehicle) | set(previous)
+                       if vehicle.get(field) != previous.get(field)}
+
+        self.vehicles[key] = vehicle
+        self.last_seen[key] = now
+        route_id = vehicle.get('route_id')
+        stop_id = vehicle.get('stop_id')
+        if route_id is not None and vehicle.get('route_name') is not None:
+            self._route_names[route_id] = vehicle['route_name']
+        if stop_id is not None and vehicle.get('current_stop') is not None:
+            self._stop_names[stop_id] = vehicle['current_stop']
+
+        # Rules of the previous route and stop are checked too, so their alerts can clear
+        route_ids = (route_id, previous.get('route_id') if previous else None)
+        stop_ids = (stop_id, previous.get('stop_id') if previous else None)
+        for rule in self._candidates('vehicle', route_ids, stop_ids):
+            if changed is None or changed.intersection(rule.inputs):
+                evaluated += self._evaluate(rule, key, now)
+        if reappeared is not None:
+            for rule in self._candidates('missing', route_ids, stop_ids):
+                evaluated += self._evaluate(rule, key, now)
+
+        # A vehicle arriving at a new stop resets that stop's headway clock
+        if stop_id is not None and (previous is None or previous.get('stop_id') != stop_id
+                                    or previous.get('route_id') != route_id):
+            subject = (route_id, stop_id)
+            self.arrivals[subject] = now
+            self._schedule(now + self.forget, None, ('arrival', subject))
+            for rule in self._candidates('headway', (route_id,), (stop_id,)):
+                evaluated += self._evaluate(rule, subject, now)
+        return evaluated
+
+    def _drop_vehicle(self, key, now):
+        evaluated = 0
+        vehicle = self.vehicles.pop(key)
+        route_ids, stop_ids = (vehicle.get('route_id'),), (vehicle.get('stop_id'),)
+        finished = trip_finished(vehicle, now)
+        if finished:
+            del self.last_seen[key]
+        else:
+            self.absent[key] = vehicle
+            self._schedule(self.last_seen[key] + self.forget, None, ('vehicle', key))
+        for rule in self._candidates('vehicle', route_ids, stop_ids):
+            evaluated += self._evaluate(rule, key, now)
+        if not finished:
+            for rule in self._candidates('missing', route_ids, stop_ids):
+                evaluated += self._evaluate(rule, key, now)
+        return evaluated
+
+    def _apply_stop_loads(self, stop_loads, now):
+        evaluated = 0
+        seen = {str(stop['stop_id']): dict(stop) for stop in stop_loads if stop.get('stop_id') is not None}
+        for stop_id, stop in seen.items():
+            previous = self.stop_loads.get(stop_id)
+            self.stop_loads[stop_id] = stop
+            if stop.get('stop_name') is not None:
+                self._stop_names[stop_id] = stop['stop_name']
+            for rule in self._candidates('stop', stop_ids=(stop_id,)):
+                if previous is None or any(stop.get(f) != previous.get(f) for f in rule.inputs):
+                    evaluated += self._evaluate(rule, stop_id, now)
+        for stop_id in [stop_id for stop_id in self.stop_loads if stop_id not in seen]:
+            del self.stop_loads[stop_id]
+            for rule in self._candidates('stop', stop_ids=(stop_id,)):
+                evaluated += self._evaluate(rule, stop_id, now)
+        return evaluated
+
+    def _schedule(self, when, rule_id, subject):
+        key = (rule_id, subject)
+        if self._scheduled.get(key) == when:
+            return
+        self._scheduled[key] = when
+        heapq.heappush(self._wakeups, (when, next(self._seq), rule_id, subject))
+
+    def _run_wakeups(self, now):
+        evaluated = 0
+        while self._wakeups and self._wakeups[0][0] <= now:
+            when, _, rule_id, subject = heapq.heappop(self._wakeups)
+            # Superseded by a later reschedule of the same check
+            if self._scheduled.get((rule_id, subject)) != when:
+                continue
+            del self._scheduled[(rule_id, subject)]
+            if rule_id is None:
+                evaluated += self._expire(subject, now)
+            elif rule_id in self.rules:
+                evaluated += self._evaluate(self.rules[rule_id], subject, now)
+        return evaluated
+
+    def _expire(self, entry, now):
+        """Forget vehicles and headway clocks that have been stale too long"""
+        evaluated = 0
+        kind, subject = entry
+        if kind == 'vehicle':
+            if subject in self.absent and self.last_seen[subject] + self.forget <= now:
+                cap = self.last_seen[subject] + self.forget + self._alert_cap
+                vehicle = self.absent[subject]
+                route_ids, stop_ids = (vehicle.get('route_id'),), (vehicle.get('stop_id'),)
+                if now < cap and self._alerting('missing', route_ids, stop_ids, subject):
+                    self._schedule(cap, None, entry)
+                    return evaluated
+                del self.absent[subject]
+                for rule in self._candidates('missing', route_ids, stop_ids):
+                    evaluated += self._evaluate(rule, subject, now)
+                del self.last_seen[subject]
+        elif kind == 'arrival':
+            last = self.arrivals.get(subject)
+            if last is not None and last + self.forget <= now:
+                cap = last + self.forget + self._alert_cap
+                if now < cap and self._alerting('headway', subject[:1], subject[1:], subject):
+                    self._schedule(cap, None, entry)
+                    return evaluated
+                del self.arrivals[subject]
+                for rule in self._candidates('headway', subject[:1], subject[1:]):
+                    evaluated += self._evaluate(rule, subject, now)
+        return evaluated
+
+    def _alerting(self, scope, route_ids, stop_ids, subject):
+        """Whether any rule currently holds a raised or pending alert for ``subject``"""
+        return any((rule.rule_id, subject) in self._states
+                   for rule in self._candidates(scope, route_ids, stop_ids))
+
+    def _evaluate(self, rule, subject, now):
+        key = (rule.rule_id, subject)
+        value = rule.check(subject, self, now)
+        state = self._states.get(key)
+
+        if value is None:
+            if state is not None:
+                if state['active'] and rule.clear:
+                    # Debounce clearing: the condition has to stay false for ``clear``
+                    state['clear_since'] = state['clear_since'] or now
+                    if now - state['clear_since'] < rule.clear:
+                        self._schedule(state['clear_since'] + rule.clear, rule.rule_id, subject)
+                        return 1
+                del self._states[key]
+                self._active.pop(key, None)
+        else:
+            if state is None:
+                state = self._states[key] = {'since': now, 'clear_since': None, 'active': False}
+            state['clear_since'] = None
+            alert = self._active.get(key)
+            if alert is not None:
+                alert['value'] = value
+                alert['message'] = rule.format(self._context(rule, subject), value)
+                alert['updated_at'] = now
+            elif now - state['since'] >= rule.hold:
+                state['active'] = True
+                self._active[key] = self._raise(rule, subject, value, now)
+            else:
+                self._schedule(state['since'] + rule.hold, rule.rule_id, subject)
+
+        wake = rule.wake_at(subject, self, now)
+        if wake is not None and wake > now:
+            self._schedule(wake, rule.rule_id, subject)
+        return 1
+
+    def _context(self, rule, subject):
+        if rule.scope in ('vehicle', 'missing'):
+            vehicle = self.vehicles.get(subject) or self.absent.get(subject) or {}
+            context = dict(vehicle)
+            context.setdefault(self.key_field, subject)
+        elif rule.scope == 'headway':
+            context = {'route_id': subject[0], 'stop_id': subject[1]}
+        else:
+            context = dict(self.stop_loads.get(subject) or {'stop_id': subject})
+        route_id, stop_id = context.get('route_id'), context.get('stop_id')
+        context.setdefault('route_name', self._route_names.get(route_id, route_id))
+        context.setdefault('stop_name', self._stop_names.get(stop_id, stop_id))
+        context.setdefault('current_stop', context['stop_name'])
+        return context
+
+    def _raise(self, rule, subject, value, now):
+        context = self._context(rule, subject)
+        return {
+            'id': next(self._alert_ids),
+            'rule_id': rule.rule_id,
+            'type': rule.kind,
+            'severity': rule.severity,
+            'message': rule.format(context, value),
+            'route_id': context.get('route_id'),
+            'stop_id': context.get('stop_id'),
+            'trip_id': context.get('trip_id'),
+            'value': value,
+            'raised_at': now,
+            'updated_at': now,
+            'acknowledged': False,
+            '_group': (rule.kind, subject),
+        }
+
+    def alerts(self, route_id=None):
+        """Active alerts, most severe first, one per alert type and subject"""
+        with self._lock:
+            return self._alerts(route_id)
+
+    def _alerts(self, route_id=None):
+        best = {}
+        for alert in self._active.values():
+            if route_id is not None and alert['route_id'] != route_id:
+                continue
+            current = best.get(alert['_group'])
+            if current is None or SEVERITY_ORDER[alert['severity']] < SEVERITY_ORDER[current['severity']]:
+                best[alert['_group']] = alert
+        ordered = sorted(best.values(), key=lambda a: (SEVERITY_ORDER[a['severity']], a['raised_at'], a['id']))
+        return [{k: v for k, v in alert.items() if k != '_group'} for alert in ordered]
+
+    def alert_counts_by_route(self):
+        counts = {}
+        for alert in self.alerts():
+            if alert['route_id'] is not None:
+                counts[alert['route_id']] = counts.get(alert['route_id'], 0) + 1
+        return counts
+
+    def acknowledge(self, alert_id):
+        with self._lock:
+            for alert in self._active.values():
+                if alert['id'] == alert_id:
+                    alert['acknowledged'] = True
+                    return True
+            return False
@@ -6,6 +6,7 @@ from datetime import datetime, time
 from typing import List, Dict
 import models
 from db import SessionLocal, engine
+from alert_engine import AlertEngine
 import pandas as pd
 
 # Create database tables
@@ -13,6 +14,8 @@ models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="Transit Operations Dashboard")
 
+alert_engine = AlertEngine()
+
 # CORS middleware configuration
 app.add_middleware(
     CORSMiddleware,
@@ -50,6 +53,15 @@ def get_system_overview(db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def get_last_stop_time(trip):
+    """Final scheduled stop of a trip"""
+    return max(trip.stop_times, key=lambda stop_time: stop_time.stop_sequence)
+
+def get_trip_end(trip):
+    """Scheduled end of a trip today, if known"""
+    arrival_time = get_last_stop_time(trip).arrival_time
+    return datetime.combine(datetime.now().date(), arrival_time) if arrival_time else None
+
 @app.get("/active-vehicles")
 def get_active_vehicles(db: Session = Depends(get_db)):
     """Get currently active vehicles and their status"""
@@ -70,9 +82,13 @@ def get_active_vehicles(db: Session = Depends(get_db)):
         
         return [{
             "trip_id": trip.trip_id,
+            "route_id": trip.route_id,
             "route_name": trip.route.route_long_name,
             "status": "On Time",  # This would be calculated based on real-time data
             "current_stop": trip.stop_times[0].stop.stop_name,  # This would be updated with real-time data
+            "stop_id": trip.stop_times[0].stop_id,
+            "last_stop_id": get_last_stop_time(trip).stop_id,
+            "trip_end": get_trip_end(trip),
             "current_location": {
                 "lat": str(trip.stop_times[0].stop.stop_lat),  # Using first stop's location as placeholder
                 "lng": str(trip.stop_times[0].stop.stop_lon)   # In real system, this would be real-time GPS data
@@ -129,18 +145,17 @@ def get_route_stops(route_id: str, db: Session = Depends(get_db)):
 @app.get("/alerts")
 def get_alerts(db: Session = Depends(get_db)):
     """Get current system alerts"""
-    # This would be connected to a real-time alert system
+    # Each request is one tick of the alert engine over the active vehicles
+    alerts = alert_engine.update(get_active_vehicles(db))
     return {
-        "alerts": [
-            {
-                "id": 1,
-                "type": "delay",
-                "severity": "medium",
-                "route_id": "route_1",
-                "message": "10 minute delay due to traffic",
-                "timestamp": datetime.now().isoformat()
-            }
-        ]
+        "alerts": [{
+            "id": alert["id"],
+            "type": alert["type"],
+            "severity": alert["severity"],
+            "route_id": alert["route_id"],
+            "message": alert["message"],
+            "timestamp": alert["raised_at"].isoformat()
+        } for alert in alerts]
     }
 
 if __name__ == "__main__":
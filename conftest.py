@@ -0,0 +1 @@
+# Makes the top-level application modules importable from tests/
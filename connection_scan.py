@@ -0,0 +1,339 @@
+"""Connection Scan reachability engine over the GTFS stop_times timetable.
+
+The timetable of one service day is flattened once into an array of
+elementary connections (one vehicle hop between two consecutive stops of a
+trip), sorted by departure time. Earliest-arrival and isochrone queries are
+then a single linear scan over that array, starting at the query time, with
+walking transfers between nearby stops. Routes can be masked per query
+("line X suspended") without rebuilding the connections.
+"""
+import math
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+INFINITY = float('inf')
+# GTFS calendar columns, indexed by date.weekday()
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def parse_time(value):
+    """Convert a GTFS time string (HH:MM[:SS], hours may exceed 24) to seconds"""
+    try:
+        parts = [int(part) for part in str(value).strip().split(':')]
+    except ValueError:
+        raise ValueError(f"Invalid time: {value}") from None
+    if len(parts) == 2:
+        parts.append(0)
+    if len(parts) != 3:
+        raise ValueError(f"Invalid time: {value}")
+    hours, minutes, seconds = parts
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _time_column(series):
+    """parse_time for a whole column of GTFS times; blanks become NaN"""
+    # A day has far fewer distinct times than stop_times rows, so parse each once
+    codes, uniques = pd.factorize(series)
+    seconds = np.empty(len(uniques) + 1)
+    for i, value in enumerate(uniques):
+        try:
+            seconds[i] = parse_time(value)
+        except ValueError:
+            seconds[i] = np.nan
+    seconds[-1] = np.nan  # factorize marks missing values with code -1
+    return seconds[codes]
+
+
+def active_service_ids(calendar_df, calendar_dates_df, day):
+    """Service ids running on ``day`` according to calendar and calendar_dates"""
+    date = int(day.strftime('%Y%m%d'))
+    services = set()
+    if not calendar_df.empty:
+        running = calendar_df[
+            (calendar_df[WEEKDAYS[day.weekday()]].astype(int) == 1) &
+            (calendar_df['start_date'].astype(int) <= date) &
+            (calendar_df['end_date'].astype(int) >= date)
+        ]
+        services.update(running['service_id'].astype(str))
+    if not calendar_dates_df.empty:
+        exceptions = calendar_dates_df[calendar_dates_df['date'].astype(int) == date]
+        exception_types = exceptions['exception_type'].astype(int)
+        services.update(exceptions.loc[exception_types == 1, 'service_id'].astype(str))
+        services.difference_update(exceptions.loc[exception_types == 2, 'service_id'].astype(str))
+    return services
+
+
+def nearest_service_day(calendar_df, calendar_dates_df, day):
+    """The day closest to ``day`` that has services, preferring the same weekday
+
+    Lets the dashboard keep answering queries when ``day`` lies outside the
+    feed's validity period. Returns ``(service_day, service_ids)``, or
+    ``(None, set())`` when the calendar has no services on any day.
+    """
+    services = active_service_ids(calendar_df, calendar_dates_df, day)
+    if services:
+        return day, services
+
+    dates = []
+    if not calendar_df.empty:
+        dates.extend(calendar_df['start_date'].astype(int))
+        dates.extend(calendar_df['end_date'].astype(int))
+    if not calendar_dates_df.empty:
+        dates.extend(calendar_dates_df['date'].astype(int))
+    if not dates:
+        return None, set()
+    first = datetime.strptime(str(min(dates)), '%Y%m%d').date()
+    last = datetime.strptime(str(max(dates)), '%Y%m%d').date()
+
+    candidates = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    candidates.sort(key=lambda candidate: (candidate.weekday() != day.weekday(), abs((candidate - day).days)))
+    for candidate in candidates:
+        services = active_service_ids(calendar_df, calendar_dates_df, candidate)
+        if services:
+            return candidate, services
+    return None, set()
+
+
+class ConnectionScan:
+    """Earliest-arrival and isochrone queries over one service day"""
+
+    def __init__(self, stop_times, trips, stops, routes=None, service_ids=None,
+                 max_walk_meters=400, walking_speed=1.2):
+        stops = stops.dropna(subset=['stop_lat', 'stop_lon'])
+        self.stop_ids = stops['stop_id'].astype(str).tolist()
+        self.stop_names = stops['stop_name'].astype(str).tolist()
+        self.stop_lats = stops['stop_lat'].astype(float).tolist()
+        self.stop_lons = stops['stop_lon'].astype(float).tolist()
+        self._stop_index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+
+        trips = trips.astype({'trip_id': str, 'route_id': str})
+        if service_ids is not None:
+            trips = trips[trips['service_id'].astype(str).isin(service_ids)]
+
+        self._build_connections(stop_times, trips)
+        self._build_routes(routes)
+        self._build_footpaths(max_walk_meters, walking_speed)
+
+    def _build_connections(self, stop_times, trips):
+        st = stop_times[['trip_id', 'stop_id', 'stop_sequence', 'arrival_time', 'departure_time']]
+        st = st.astype({'trip_id': str, 'stop_id': str})
+        st = st[st['trip_id'].isin(trips['trip_id']) & st['stop_id'].isin(self._stop_index)]
+        st = st.sort_values(['trip_id', 'stop_sequence'], kind='stable')
+
+        trip_codes, self.trip_ids = pd.factorize(st['trip_id'])
+        stop_codes = st['stop_id'].map(self._stop_index).to_numpy()
+        arrivals = _time_column(st['arrival_time'])
+        departures = _time_column(st['departure_time'])
+        # GTFS allows either time to be given alone at a stop
+        arrivals = np.where(np.isnan(arrivals), departures, arrivals)
+        departures = np.where(np.isnan(departures), arrivals, departures)
+
+        # A connection joins each stop_time row to the next row of the same trip
+        valid = (trip_codes[:-1] == trip_codes[1:]) & ~np.isnan(departures[:-1]) & ~np.isnan(arrivals[1:])
+        dep_time = departures[:-1][valid].astype(np.int64)
+        arr_time = arrivals[1:][valid].astype(np.int64)
+        order = np.lexsort((arr_time, dep_time))
+
+        route_of_trip = dict(zip(trips['trip_id'], trips['route_id']))
+        route_codes, self.route_ids = pd.factorize(pd.Series(self.trip_ids).map(route_of_trip))
+        trip = trip_codes[:-1][valid][order]
+
+        # Plain lists: element access in the scan loop is much faster than on numpy arrays
+        self._dep_stop = stop_codes[:-1][valid][order].tolist()
+        self._arr_stop = stop_codes[1:][valid][order].tolist()
+        self._dep_time = dep_time[order].tolist()
+        self._arr_time = arr_time[order].tolist()
+        self._trip = trip.tolist()
+        self._trip_route = route_codes.tolist()
+        self.trip_ids = list(self.trip_ids)
+        self.route_ids = list(self.route_ids)
+
+    def _build_routes(self, routes):
+        """Map route ids and short names (e.g. "U1") to route indexes for masking"""
+        self._route_lookup = {}
+        for i, route_id in enumerate(self.route_ids):
+            self._route_lookup.setdefault(route_id, set()).add(i)
+        self.route_names = list(self.route_ids)
+        if routes is not None and not routes.empty:
+            short_names = dict(zip(routes['route_id'].astype(str), routes['route_short_name'].astype(str)))
+            for i, route_id in enumerate(self.route_ids):
+                name = short_names.get(route_id)
+                if name is not None:
+                    self.route_names[i] = name
+                    self._route_lookup.setdefault(name, set()).add(i)
+
+    def _build_footpaths(self, max_walk_meters, walking_speed):
+        """Walking transfers between stops within ``max_walk_meters`` of each other"""
+        self.footpaths = [[] for _ in self.stop_ids]
+        if not self.stop_ids or max_walk_meters <= 0:
+            return
+        lats = np.radians(self.stop_lats)
+        lons = np.radians(self.stop_lons)
+        # Equirectangular projection is accurate to well under a metre at walking distances
+        y = lats * 6371000
+        x = lons * 6371000 * math.cos(float(lats.mean()))
+        order = np.argsort(y)
+        ys, xs = y[order], x[order]
+        lower = np.searchsorted(ys, ys - max_walk_meters, side='left')
+        upper = np.searchsorted(ys, ys + max_walk_meters, side='right')
+        for k, i in enumerate(order):
+            window = slice(lower[k], upper[k])
+            distance = np.hypot(xs[window] - xs[k], ys[window] - ys[k])
+            near = distance <= max_walk_meters
+            for j, d in zip(order[window][near], distance[near]):
+                if j != i:
+                    self.footpaths[i].append((int(j), int(math.ceil(d / walking_speed))))
+
+    @property
+    def connection_count(self):
+        return len(self._dep_time)
+
+    @property
+    def last_arrival(self):
+        """Latest arrival of the day in seconds; past 86400 for service after midnight"""
+        return max(self._arr_time, default=0)
+
+    def stop_index(self, stop_id):
+        if str(stop_id) not in self._stop_index:
+            raise KeyError(f"Unknown stop: {stop_id}")
+        return self._stop_index[str(stop_id)]
+
+    def route_mask(self, suspended_routes):
+        """Flag the routes (ids or short names) whose connections are skipped"""
+        if not suspended_routes:
+            return None
+        mask = bytearray(len(self.route_ids))
+        for route in suspended_routes:
+            if route not in self._route_lookup:
+                raise KeyError(f"Unknown route: {route}")
+            for i in self._route_lookup[route]:
+                mask[i] = 1
+        return mask
+
+    def _scan(self, origin, departure, target=-1, max_duration=None, mask=None):
+        earliest = [INFINITY] * len(self.stop_ids)
+        via_connection = [-1] * len(self.stop_ids)
+        via_walk = [-1] * len(self.stop_ids)
+        boarded = [-1] * len(self.trip_ids)
+        earliest[origin] = departure
+        for stop, walk in self.footpaths[origin]:
+            earliest[stop] = departure + walk
+            via_walk[stop] = origin
+
+        limit = departure + max_duration if max_duration is not None else INFINITY
+        if target >= 0:
+            limit = min(limit, earliest[target])
+
+        dep_stop, arr_stop = self._dep_stop, self._arr_stop
+        dep_time, arr_time = self._dep_time, self._arr_time
+        trip_of, trip_route, footpaths = self._trip, self._trip_route, self.footpaths
+        for i in range(bisect_left(dep_time, departure), len(dep_time)):
+            d = dep_time[i]
+            if d > limit:
+                break
+            t = trip_of[i]
+            if boarded[t] < 0:
+                if earliest[dep_stop[i]] > d or (mask is not None and mask[trip_route[t]]):
+                    continue
+                boarded[t] = i
+            a = arr_time[i]
+            s = arr_stop[i]
+            if a < earliest[s]:
+                earliest[s] = a
+                via_connection[s] = i
+                via_walk[s] = -1
+                if s == target:
+                    limit = min(limit, a)
+                for stop, walk in footpaths[s]:
+                    if a + walk < earliest[stop]:
+                        earliest[stop] = a + walk
+                        via_connection[stop] = -1
+                        via_walk[stop] = s
+                        if stop == target:
+                            limit = min(limit, a + walk)
+
+        if max_duration is not None:
+            earliest = [a if a <= departure + max_duration else INFINITY for a in earliest]
+        return earliest, via_connection, via_walk, boarded
+
+    def _legs(self, target, via_connection, via_walk, boarded, earliest):
+        legs = []
+        stop = target
+        while via_connection[stop] >= 0 or via_walk[stop] >= 0:
+            if via_walk[stop] >= 0:
+                start = via_walk[stop]
+                legs.append({
+                    'mode': 'walk',
+                    'from_stop_id': self.stop_ids[start],
+                    'to_stop_id': self.stop_ids[stop],
+                    'departure': format_time(earliest[stop] - self._walk_seconds(start, stop)),
+                    'arrival': format_time(earliest[stop])
+                })
+            else:
+                last = via_connection[stop]
+                first = boarded[self._trip[last]]
+                start = self._dep_stop[first]
+                legs.append({
+                    'mode': 'ride',
+                    'route': self.route_names[self._trip_route[self._trip[last]]],
+                    'trip_id': self.trip_ids[self._trip[last]],
+                    'from_stop_id': self.stop_ids[start],
+                    'to_stop_id': self.stop_ids[stop],
+                    'departure': format_time(self._dep_time[first]),
+                    'arrival': format_time(self._arr_time[last])
+                })
+            stop = start
+        for leg in legs:
+            leg['from_stop'] = self.stop_names[self._stop_index[leg['from_stop_id']]]
+            leg['to_stop'] = self.stop_names[self._stop_index[leg['to_stop_id']]]
+        return legs[::-1]
+
+    def _walk_seconds(self, start, stop):
+        for other, walk in self.footpaths[start]:
+            if other == stop:
+                return walk
+        return 0
+
+    def earliest_arrival(self, origin, target, departure, suspended_routes=(), max_minutes=None):
+        """Earliest arrival at ``target`` leaving ``origin`` at ``departure`` seconds, with its legs"""
+        origin_index, target_index = self.stop_index(origin), self.stop_index(target)
+        max_duration = max_minutes * 60 if max_minutes is not None else None
+        earliest, via_connection, via_walk, boarded = self._scan(
+            origin_index, departure, target_index, max_duration, self.route_mask(suspended_routes)
+        )
+        if earliest[target_index] == INFINITY:
+            return None
+        return {
+            'from_stop_id': self.stop_ids[origin_index],
+            'to_stop_id': self.stop_ids[target_index],
+            'departure': format_time(departure),
+            'arrival': format_time(earliest[target_index]),
+            'duration_minutes': round((earliest[target_index] - departure) / 60, 1),
+            'legs': self._legs(target_index, via_connection, via_walk, boarded, earliest)
+        }
+
+    def isochrone(self, origin, departure, max_minutes=60, suspended_routes=()):
+        """Every stop reachable from ``origin`` within ``max_minutes``, nearest first"""
+        origin_index = self.stop_index(origin)
+        earliest = self._scan(origin_index, departure, max_duration=max_minutes * 60,
+                              mask=self.route_mask(suspended_routes))[0]
+        reachable = [
+            {
+                'stop_id': self.stop_ids[i],
+                'stop_name': self.stop_names[i],
+                'lat': self.stop_lats[i],
+                'lng': self.stop_lons[i],
+                'arrival': format_time(arrival),
+                'minutes': round((arrival - departure) / 60, 1)
+            }
+            for i, arrival in enumerate(earliest) if arrival != INFINITY
+        ]
+        return sorted(reachable, key=lambda stop: stop['minutes'])
@@ -5,11 +5,15 @@ from sqlalchemy import func
 from datetime import datetime, timedelta
 import models
 from db import SessionLocal
+from alert_engine import AlertEngine
 import json
 
 app = Flask(__name__)
 CORS(app)
 
+alert_engine = AlertEngine()
+ALERT_LEVELS = {"high": "danger", "medium": "warning", "low": "info"}
+
 def get_db():
     db = SessionLocal()
     return db
@@ -40,11 +44,14 @@ def get_active_vehicles():
         
         vehicles = []
         statuses = ["On Time", "Delayed", "Very Late"]
+        delays = [0, 5, 12]
         for i, trip in enumerate(trips):
             vehicles.append({
                 "trip_id": trip.trip_id,
+                "route_id": trip.route_id,
                 "route_name": trip.route.route_long_name or trip.route.route_short_name or f"Route {trip.route_id}",
                 "status": statuses[i % 3],
+                "delay_minutes": delays[i % 3],
                 "current_stop": f"Stop {i+1}",
                 "lat": 40.7128 + (i * 0.01),
                 "lng": -74.0060 + (i * 0.01)
@@ -99,12 +106,13 @@ def api_route_performance():
 
 @app.route('/api/alerts')
 def api_alerts():
-    alerts = [
-        {"id": 1, "level": "warning", "message": "Route 1: 5 min delay due to traffic", "timestamp": datetime.now().isoformat()},
-        {"id": 2, "level": "info", "message": "Route 3: On schedule", "timestamp": datetime.now().isoformat()},
-        {"id": 3, "level": "danger", "message": "Route 7: Vehicle breakdown reported", "timestamp": datetime.now().isoformat()}
-    ]
-    return jsonify(alerts)
+    alerts = alert_engine.update(get_active_vehicles())
+    return jsonify([{
+        "id": alert["id"],
+        "level": ALERT_LEVELS[alert["severity"]],
+        "message": alert["message"],
+        "timestamp": alert["raised_at"].isoformat()
+    } for alert in alerts])
 
 @app.route('/api/passenger-stats')
 def api_passenger_stats():
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request
 from flask_cors import CORS
 from sqlalchemy.orm import Session
 from sqlalchemy import func, text
@@ -6,24 +6,78 @@ from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
 import random
+import math
+import threading
 import models
 from db import SessionLocal
+from alert_engine import AlertEngine, DEFAULT_RULES, rules_from_config
+from connection_scan import ConnectionScan, format_time, nearest_service_day, parse_time
 import json
 
 app = Flask(__name__)
 CORS(app)
 
+# Alert rules use the default thresholds with German operator messages
+ALERT_MESSAGES = {
+    'delay': "Verspätung auf Linie {route_name} - {value} Min",
+    'vehicle_load': "Fahrzeug auf Linie {route_name} zu {value:.0f}% ausgelastet",
+    'missing_vehicle': "Fahrzeugausfall auf Linie {route_name} - seit {value:.0f} Min ohne Meldung",
+    'headway_gap': "Taktlücke auf Linie {route_name} bei Station {stop_name} - {value:.0f} Min",
+    'stop_overcrowding': "Überfüllung bei Station {stop_name}"
+}
+SEVERITY_LABELS = {'high': 'Hoch', 'medium': 'Mittel', 'low': 'Niedrig'}
+operational_alerts = AlertEngine(rules_from_config(
+    [dict(rule, message=ALERT_MESSAGES[rule['type']]) for rule in DEFAULT_RULES]
+))
+
 # Load GTFS data from CSV files
 try:
     routes_df = pd.read_csv('routes_clean.csv')
     stops_df = pd.read_csv('stops_clean.csv')
     trips_df = pd.read_csv('trips_clean.csv')
     stop_times_df = pd.read_csv('stop_times_clean.csv')
-    calendar_df = pd.read_csv('calendar.csv')
+    calendar_df = pd.read_csv('calendar.csv', encoding='utf-8-sig')
+    calendar_dates_df = pd.read_csv('calendar_dates.csv', encoding='utf-8-sig')
     print("✅ GTFS CSV files loaded successfully")
 except Exception as e:
     print(f"❌ Error loading CSV files: {e}")
-    routes_df = stops_df = trips_df = stop_times_df = calendar_df = pd.DataFrame()
+    routes_df = stops_df = trips_df = stop_times_df = calendar_df = calendar_dates_df = pd.DataFrame()
+
+def gtfs_seconds(value):
+    """Seconds after service-day midnight of a GTFS time, or None if it is not a valid time"""
+    try:
+        return parse_time(str(value))
+    except ValueError:
+        return None
+
+# Final stop and scheduled end of every trip, so trips that finished their run are not
+# reported as missing, and the end of each route's last trip so headway clocks stop there
+trip_last_stops, trip_end_seconds, route_end_seconds = {}, {}, {}
+if not stop_times_df.empty:
+    last_stop_times = stop_times_df.sort_values('stop_sequence').groupby('trip_id')[['stop_id', 'arrival_time']].last()
+    trip_last_stops = dict(zip(last_stop_times.index.astype(str), last_stop_times['stop_id'].astype(str)))
+    trip_end_seconds = {
+        trip_id: seconds for trip_id, seconds in
+        zip(last_stop_times.index.astype(str), last_stop_times['arrival_time'].map(gtfs_seconds))
+        if seconds is not None
+    }
+# Latest arrival in the feed; service days with trips past 24:00 run into the next morning
+feed_last_arrival = max(trip_end_seconds.values(), default=0)
+if not trips_df.empty:
+    for trip_id, route_id in zip(trips_df['trip_id'].astype(str), trips_df['route_id'].astype(str)):
+        if trip_id in trip_end_seconds:
+            route_end_seconds[route_id] = max(route_end_seconds.get(route_id, 0), trip_end_seconds[trip_id])
+_alert_service_day = {'day': None}
+
+def service_datetime(seconds, day=None):
+    """Datetime of a GTFS time given in seconds, counted from midnight of the service day"""
+    day = day or datetime.now().date()
+    return datetime.combine(day, datetime.min.time()) + timedelta(seconds=seconds)
+
+# Connection Scan engine over today's timetable, rebuilt once per service day. The lock
+# makes concurrent requests wait for a rebuild instead of seeing a half-built engine
+_connection_scan = {'day': None, 'scan': None, 'service_day': None, 'error': None}
+_connection_scan_lock = threading.Lock()
 
 def get_db():
     try:
@@ -86,6 +140,9 @@ def get_active_trips():
                     'delay_minutes': int(delay_minutes),
                     'current_stop': str(stop['stop_name']),
                     'stop_id': str(stop['stop_id']),
+                    'last_stop_id': trip_last_stops.get(str(trip['trip_id'])),
+                    'trip_end': (service_datetime(trip_end_seconds[str(trip['trip_id'])])
+                                 if str(trip['trip_id']) in trip_end_seconds else None),
                     'passengers': random.randint(5, 80),
                     'capacity': 100,
                     'lat': float(base_lat + random.uniform(-0.001, 0.001)),
@@ -141,6 +198,7 @@ def get_route_status():
     if routes_df.empty:
         return []
     
+    alert_counts = operational_alerts.alert_counts_by_route()
     route_status = []
     for _, route in routes_df.head(15).iterrows():  # Limit for performance
         # Simulate route operational status
@@ -163,55 +221,32 @@ def get_route_status():
             'on_time_performance': float(round(on_time_perf, 1)),
             'status': status,
             'passengers_total': random.randint(50, 400),
-            'alerts_count': random.randint(0, 3)
+            'alerts_count': alert_counts.get(str(route['route_id']), 0)
         })
     
     return route_status
 
 def get_critical_alerts():
     """Get current critical operational alerts"""
-    alert_types = [
-        "Fahrzeugausfall auf Linie {route}",
-        "Signalstörung bei Station {stop}",
-        "Verspätung auf Linie {route} - {delay} Min",
-        "Überfüllung bei Station {stop}",
-        "Weichenstörung Bereich {area}",
-        "Witterungsbedingte Verzögerungen"
-    ]
-    
-    alerts = []
-    num_alerts = random.randint(2, 6)
-    
-    for i in range(num_alerts):
-        alert_type = random.choice(alert_types)
-        severity = random.choice(['Hoch', 'Mittel', 'Niedrig'])
-        
-        # Replace placeholders with real data
-        if '{route}' in alert_type and not routes_df.empty:
-            route = routes_df.sample(1).iloc[0]
-            alert_type = alert_type.replace('{route}', route['route_short_name'])
-        
-        if '{stop}' in alert_type and not stops_df.empty:
-            stop = stops_df.sample(1).iloc[0]
-            alert_type = alert_type.replace('{stop}', stop['stop_name'])
-        
-        if '{delay}' in alert_type:
-            delay = random.randint(5, 20)
-            alert_type = alert_type.replace('{delay}', str(delay))
-        
-        if '{area}' in alert_type:
-            areas = ['Zentrum', 'Süden', 'Norden', 'Osten', 'Westen']
-            alert_type = alert_type.replace('{area}', random.choice(areas))
-        
-        alerts.append({
-            'id': i + 1,
-            'message': alert_type,
-            'severity': severity,
-            'timestamp': (datetime.now() - timedelta(minutes=random.randint(1, 120))).strftime('%H:%M'),
-            'acknowledged': random.choice([True, False])
-        })
+    today = datetime.now().date()
+    if _alert_service_day['day'] != today:
+        operational_alerts.set_service_ends(
+            {route_id: service_datetime(seconds, today) for route_id, seconds in route_end_seconds.items()}
+        )
+        _alert_service_day['day'] = today
+
+    # Every poll is one tick of the alert engine over the live vehicle state. Station loads
+    # are not passed: they are simulated as a fresh random sample on every call, which
+    # would never hold long enough to raise an alert and would disagree with /api/passenger-flow
+    alerts = operational_alerts.update(get_active_trips())
     
-    return alerts
+    return [{
+        'id': alert['id'],
+        'message': alert['message'],
+        'severity': SEVERITY_LABELS[alert['severity']],
+        'timestamp': alert['raised_at'].strftime('%H:%M'),
+        'acknowledged': alert['acknowledged']
+    } for alert in alerts]
 
 def get_passenger_flow():
     """Get current passenger flow data"""
@@ -248,6 +283,7 @@ def get_passenger_flow():
         capacity = 200
         
         station_loads.append({
+            'stop_id': str(stop['stop_id']),
             'stop_name': str(stop['stop_name']),
             'current_load': int(current_load),
             'capacity': int(capacity),
@@ -260,6 +296,121 @@ def get_passenger_flow():
         'station_loads': sorted(station_loads, key=lambda x: x['load_percentage'], reverse=True)
     }
 
+def build_connection_scan(day):
+    """Build the reachability engine for a calendar day
+
+    Returns a dict with ``scan``, ``service_day`` and ``error``; ``scan`` is
+    None when no timetable can be built and ``error`` gives the reason.
+    """
+    if stop_times_df.empty or trips_df.empty or stops_df.empty:
+        return {'scan': None, 'service_day': None, 'error': 'Timetable data not available'}
+    
+    # Without any calendar data every trip is assumed to run
+    service_day, service_ids = day, None
+    if not (calendar_df.empty and calendar_dates_df.empty):
+        # Outside the feed's validity period the nearest day with services is used instead
+        service_day, service_ids = nearest_service_day(calendar_df, calendar_dates_df, day)
+        if service_day is None:
+            return {'scan': None, 'service_day': None, 'error': 'No services scheduled in the GTFS calendar'}
+    
+    scan = ConnectionScan(stop_times_df, trips_df, stops_df, routes_df, service_ids=service_ids)
+    if scan.connection_count == 0:
+        return {'scan': None, 'service_day': service_day,
+                'error': f"No connections scheduled on service day {service_day}"}
+    print(f"🕒 Built {scan.connection_count} connections for service day {service_day}")
+    return {'scan': scan, 'service_day': service_day, 'error': None}
+
+def get_connection_scan(now=None):
+    """Get a snapshot of the reachability engine for the current service day
+
+    Handlers must read ``scan``, ``service_day``, ``error`` and ``clock`` (the
+    current time in seconds on that service day) from the same snapshot,
+    since the engine is replaced when the day changes.
+    """
+    now = now or datetime.now()
+    today, yesterday = now.date(), now.date() - timedelta(days=1)
+    seconds = now.hour * 3600 + now.minute * 60 + now.second
+    with _connection_scan_lock:
+        # Trips past 24:00 belong to the previous service day: until its last one has
+        # arrived, early-morning queries run on yesterday's timetable at time + 24h
+        if _connection_scan['day'] not in (yesterday, today) and seconds + 86400 <= feed_last_arrival:
+            _connection_scan.update(build_connection_scan(yesterday), day=yesterday)
+        if _connection_scan['day'] == yesterday:
+            scan = _connection_scan['scan']
+            if scan is not None and seconds + 86400 <= scan.last_arrival:
+                return dict(_connection_scan, clock=seconds + 86400)
+        if _connection_scan['day'] != today:
+            _connection_scan.update(build_connection_scan(today), day=today)
+        return dict(_connection_scan, clock=seconds)
+
+def get_reachability_params(default_max_minutes, clock):
+    """Departure time, time budget and suspended lines shared by the reachability endpoints
+
+    ``time`` is read on the snapshot's service day and defaults to its ``clock``.
+    """
+    departure = parse_time(request.args['time']) if 'time' in request.args else clock
+    max_minutes = int(request.args.get('max_minutes', default_max_minutes))
+    if max_minutes <= 0:
+        raise ValueError('max_minutes must be positive')
+    suspended = [route.strip() for route in request.args.get('suspended', '').split(',') if route.strip()]
+    return departure, max_minutes, suspended
+
+def get_earliest_arrival():
+    """Get the earliest arrival between two stops"""
+    snapshot = get_connection_scan()
+    scan = snapshot['scan']
+    if scan is None:
+        return {'error': snapshot['error']}, 503
+    if 'from' not in request.args or 'to' not in request.args:
+        return {'error': "Parameters 'from' and 'to' are required"}, 400
+    try:
+        # The budget bounds the scan when the target cannot be reached, e.g. with a line suspended
+        departure, max_minutes, suspended = get_reachability_params(90, snapshot['clock'])
+        journey = scan.earliest_arrival(request.args['from'], request.args['to'], departure,
+                                        suspended_routes=suspended, max_minutes=max_minutes)
+    except (KeyError, ValueError) as e:
+        return {'error': e.args[0]}, 400
+    
+    return {
+        'reachable': journey is not None,
+        'journey': journey,
+        'max_minutes': max_minutes,
+        'service_day': snapshot['service_day'].isoformat(),
+        'suspended_routes': suspended
+    }, 200
+
+def get_isochrone():
+    """Get all stops reachable from a stop within a time budget"""
+    snapshot = get_connection_scan()
+    scan = snapshot['scan']
+    if scan is None:
+        return {'error': snapshot['error']}, 503
+    if 'from' not in request.args:
+        return {'error': "Parameter 'from' is required"}, 400
+    try:
+        departure, max_minutes, suspended = get_reachability_params(30, snapshot['clock'])
+        stops = scan.isochrone(request.args['from'], departure, max_minutes=max_minutes,
+                               suspended_routes=suspended)
+    except (KeyError, ValueError) as e:
+        return {'error': e.args[0]}, 400
+    
+    # Stop counts per 10-minute band for the isochrone legend
+    band_counts = [0] * max(1, math.ceil(max_minutes / 10))
+    for stop in stops:
+        band_counts[max(0, math.ceil(stop['minutes'] / 10) - 1)] += 1
+    bands = [{'max_minutes': min((i + 1) * 10, max_minutes), 'stops': count} for i, count in enumerate(band_counts)]
+    
+    return {
+        'from_stop_id': request.args['from'],
+        'departure': format_time(departure),
+        'max_minutes': max_minutes,
+        'reachable_stops': len(stops),
+        'bands': bands,
+        'stops': stops,
+        'service_day': snapshot['service_day'].isoformat(),
+        'suspended_routes': suspended
+    }, 200
+
 # API Routes
 @app.route('/')
 def operational_dashboard():
@@ -285,6 +436,16 @@ def api_critical_alerts():
 def api_passenger_flow():
     return jsonify(get_passenger_flow())
 
+@app.route('/api/earliest-arrival')
+def api_earliest_arrival():
+    result, status = get_earliest_arrival()
+    return jsonify(result), status
+
+@app.route('/api/isochrone')
+def api_isochrone():
+    result, status = get_isochrone()
+    return jsonify(result), status
+
 @app.route('/api/system-health')
 def api_system_health():
     """Real-time system health metrics"""
@@ -0,0 +1,238 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from alert_engine import AlertEngine, rules_from_config
+
+START = datetime(2025, 3, 20, 8, 0)
+
+
+def at(minutes=0, seconds=0):
+    return START + timedelta(minutes=minutes, seconds=seconds)
+
+
+def vehicle(trip_id='t1', route_id='U1', stop_id='s1', **fields):
+    return dict(trip_id=trip_id, route_id=route_id, route_name=route_id, stop_id=stop_id, **fields)
+
+
+def engine(*rules):
+    return AlertEngine(rules_from_config(rules))
+
+
+def test_hold_debounces_raising_until_condition_persists():
+    alerts = engine({'id': 'delay', 'type': 'delay', 'threshold': 5, 'hold_seconds': 30})
+
+    assert alerts.update([vehicle(delay_minutes=8)], now=at()) == []
+    raised = alerts.update([vehicle(delay_minutes=8)], now=at(seconds=31))
+
+    assert [alert['rule_id'] for alert in raised] == ['delay']
+    assert raised[0]['value'] == 8
+
+
+def test_condition_clearing_within_hold_never_raises():
+    alerts = engine({'id': 'delay', 'type': 'delay', 'threshold': 5, 'hold_seconds': 30})
+
+    alerts.update([vehicle(delay_minutes=8)], now=at())
+    alerts.update([vehicle(delay_minutes=1)], now=at(seconds=10))
+
+    assert alerts.update([vehicle(delay_minutes=1)], now=at(seconds=40)) == []
+
+
+def test_clear_seconds_debounces_clearing():
+    alerts = engine({'id': 'crowd', 'type': 'stop_overcrowding', 'threshold': 90, 'clear_seconds': 60})
+    full = [{'stop_id': 's1', 'stop_name': 'Karlsplatz', 'current_load': 190, 'capacity': 200}]
+
+    assert len(alerts.update(stop_loads=full, now=at())) == 1
+    assert len(alerts.update(stop_loads=[], now=at(seconds=10))) == 1
+    assert alerts.update(stop_loads=[], now=at(seconds=71)) == []
+
+
+def test_alerts_are_deduplicated_per_type_and_subject():
+    alerts = engine(
+        {'id': 'delay-medium', 'type': 'delay', 'threshold': 5, 'severity': 'medium'},
+        {'id': 'delay-high', 'type': 'delay', 'threshold': 10, 'severity': 'high'},
+    )
+
+    raised = alerts.update([vehicle(delay_minutes=12), vehicle('t2', delay_minutes=6)], now=at())
+
+    assert [(alert['trip_id'], alert['severity']) for alert in raised] == [('t1', 'high'), ('t2', 'medium')]
+
+
+def test_repeated_condition_keeps_one_alert_id():
+    alerts = engine({'id': 'delay', 'type': 'delay', 'threshold': 5})
+
+    first = alerts.update([vehicle(delay_minutes=6)], now=at())
+    second = alerts.update([vehicle(delay_minutes=9)], now=at(1))
+
+    assert [alert['id'] for alert in second] == [first[0]['id']]
+    assert second[0]['value'] == 9
+
+
+def test_only_rules_whose_inputs_changed_are_evaluated():
+    alerts = engine({'id': 'delay', 'type': 'delay', 'threshold': 5})
+    alerts.update([vehicle(delay_minutes=1, passengers=10)], now=at())
+
+    alerts.update([vehicle(delay_minutes=1, passengers=50)], now=at(1))
+    assert alerts.last_tick['evaluated'] == 0
+
+    alerts.update([vehicle(delay_minutes=2, passengers=50)], now=at(2))
+    assert alerts.last_tick['evaluated'] == 1
+
+
+def test_route_rules_only_apply_to_their_route():
+    alerts = engine({'id': 'u1-delay', 'type': 'delay', 'threshold': 3, 'route_id': 'U1'})
+
+    raised = alerts.update([vehicle('t1', 'U1', delay_minutes=4), vehicle('t2', 'U2', delay_minutes=9)], now=at())
+
+    assert [alert['trip_id'] for alert in raised] == ['t1']
+    assert alerts.alert_counts_by_route() == {'U1': 1}
+
+
+def test_stop_rules_are_only_evaluated_at_their_stop():
+    alerts = engine(*[{'id': f'delay-s{i}', 'type': 'delay', 'threshold': 3, 'stop_id': f's{i}'} for i in range(100)])
+
+    raised = alerts.update([vehicle('t1', stop_id='s7', delay_minutes=4)], now=at())
+    assert alerts.last_tick['evaluated'] == 1
+    assert [alert['rule_id'] for alert in raised] == ['delay-s7']
+
+    assert alerts.update([vehicle('t1', stop_id='s8', delay_minutes=1)], now=at(1)) == []
+    assert alerts.last_tick['evaluated'] == 2
+
+
+def test_missing_vehicle_value_keeps_growing():
+    alerts = engine({'id': 'missing', 'type': 'missing_vehicle', 'threshold': 3})
+    alerts.update([vehicle()], now=at())
+
+    assert alerts.update([], now=at(2)) == []
+    assert round(alerts.update([], now=at(4))[0]['value']) == 4
+    assert round(alerts.update([], now=at(20))[0]['value']) == 20
+
+
+def test_missing_vehicle_clears_when_it_reappears():
+    alerts = engine({'id': 'missing', 'type': 'missing_vehicle', 'threshold': 3})
+    alerts.update([vehicle()], now=at())
+    alerts.update([], now=at(5))
+
+    assert alerts.update([vehicle()], now=at(6)) == []
+
+
+def test_finished_trip_is_not_reported_missing():
+    alerts = engine({'id': 'missing', 'type': 'missing_vehicle', 'threshold': 3})
+    alerts.update([vehicle(stop_id='end', last_stop_id='end')], now=at())
+
+    assert alerts.update([], now=at(10)) == []
+    assert alerts.absent == {}
+
+
+def test_missing_alert_clears_at_trip_end():
+    alerts = engine({'id': 'missing', 'type': 'missing_vehicle', 'threshold': 3})
+    alerts.update([vehicle(trip_end=at(6))], now=at())
+
+    assert len(alerts.update([], now=at(4))) == 1
+    assert alerts.update([], now=at(7)) == []
+
+
+def test_long_headway_threshold_fires_and_keeps_growing():
+    alerts = engine({'id': 'gap', 'type': 'headway_gap', 'threshold': 40})
+    alerts.update([vehicle()], now=at())
+
+    assert alerts.update([], now=at(39)) == []
+    assert round(alerts.update([], now=at(41))[0]['value']) == 41
+    assert round(alerts.update([], now=at(120))[0]['value']) == 120
+
+
+def test_headway_gap_clears_on_next_arrival():
+    alerts = engine({'id': 'gap', 'type': 'headway_gap', 'threshold': 20})
+    alerts.update([vehicle('t1')], now=at())
+    alerts.update([], now=at(25))
+
+    assert alerts.update([vehicle('t2')], now=at(26)) == []
+
+
+def test_stale_vehicles_and_clocks_expire_without_alerts():
+    alerts = engine({'id': 'delay', 'type': 'delay', 'threshold': 5})
+    alerts.update([vehicle()], now=at())
+    alerts.update([], now=at(1))
+
+    alerts.update([], now=at(alerts.forget.total_seconds() / 60 + 2))
+
+    assert alerts.absent == {}
+    assert alerts.last_seen == {}
+    assert alerts.arrivals == {}
+
+
+def test_forget_horizon_covers_longest_threshold():
+    alerts = AlertEngine(rules_from_config([{'type': 'headway_gap', 'threshold': 90}]), forget_minutes=30)
+
+    assert alerts.forget == timedelta(minutes=120)
+
+
+def test_alerting_subjects_are_forgotten_after_the_cap():
+    alerts = AlertEngine(rules_from_config([
+        {'id': 'missing', 'type': 'missing_vehicle', 'threshold': 3},
+        {'id': 'gap', 'type': 'headway_gap', 'threshold': 20},
+    ]), forget_minutes=30, max_alert_minutes=60)
+    alerts.update([vehicle()], now=at())
+
+    assert len(alerts.update([], now=at(100))) == 2
+    assert alerts.update([], now=at(111)) == []
+    assert alerts.absent == {}
+    assert alerts.arrivals == {}
+
+
+def test_rotating_feed_keeps_a_bounded_number_of_alerts():
+    alerts = engine({'id': 'missing', 'type': 'missing_vehicle', 'threshold': 3})
+    horizon = (alerts.forget + alerts._alert_cap).total_seconds() / 60
+
+    for minute in range(240):
+        raised = alerts.update([vehicle(f't{minute}-{i}', stop_id=f's{i}') for i in range(20)], now=at(minute))
+
+    assert len(raised) <= 20 * horizon
+    assert len(alerts.last_seen) <= 20 * (horizon + 1)
+
+
+def test_headway_clock_stops_at_end_of_service():
+    alerts = engine({'id': 'gap', 'type': 'headway_gap', 'threshold': 20})
+    alerts.set_service_ends({'U1': at(30)})
+    alerts.update([vehicle()], now=at())
+
+    assert len(alerts.update([], now=at(25))) == 1
+    assert alerts.update([], now=at(31)) == []
+
+
+def test_unknown_rule_type_is_rejected():
+    with pytest.raises(ValueError):
+        rules_from_config([{'type': 'weather', 'threshold': 1}])
+
+
+def test_concurrent_updates_and_reads():
+    alerts = AlertEngine()
+    errors = []
+    done = threading.Event()
+
+    def tick():
+        for k in range(200):
+            vehicles = [vehicle(f't{i}', f'R{i % 7}', f's{(i + k) % 30}', delay_minutes=(i + k) % 15)
+                        for i in range(50 + k % 100)]
+            try:
+                alerts.update(vehicles, now=at(seconds=20 * k))
+            except Exception as e:
+                errors.append(e)
+        done.set()
+
+    def read():
+        while not done.is_set():
+            try:
+                alerts.alert_counts_by_route()
+                alerts.alerts()
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=tick)] + [threading.Thread(target=read) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
@@ -0,0 +1,131 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from connection_scan import WEEKDAYS, ConnectionScan, active_service_ids, nearest_service_day, parse_time
+
+# Line 1 runs A - B - C, line 2 runs A - D, and D is a short walk from C. E is isolated.
+STOPS = pd.DataFrame({
+    'stop_id': ['A', 'B', 'C', 'D', 'E'],
+    'stop_name': ['Alpha', 'Bravo', 'Charlie', 'Delta', 'Echo'],
+    'stop_lat': [48.200, 48.210, 48.220, 48.221, 48.300],
+    'stop_lon': [16.370, 16.370, 16.370, 16.370, 16.500],
+})
+ROUTES = pd.DataFrame({'route_id': ['R1', 'R2'], 'route_short_name': ['1', '2']})
+TRIPS = pd.DataFrame({
+    'trip_id': ['t1', 't2', 't3'],
+    'route_id': ['R1', 'R2', 'R2'],
+    'service_id': ['WD', 'WD', 'WE'],
+})
+STOP_TIMES = pd.DataFrame([
+    ('t1', 'A', 1, '08:00:00', '08:00:00'),
+    ('t1', 'B', 2, '08:10:00', ''),
+    ('t1', 'C', 3, '08:20:00', '08:20:00'),
+    ('t2', 'A', 1, '08:02:00', '08:02:00'),
+    ('t2', 'D', 2, '08:08:00', '08:08:00'),
+    ('t3', 'A', 1, '07:00:00', '07:00:00'),
+    ('t3', 'E', 2, '07:05:00', '07:05:00'),
+], columns=['trip_id', 'stop_id', 'stop_sequence', 'arrival_time', 'departure_time'])
+
+CALENDAR = pd.DataFrame({
+    'service_id': ['WD', 'WE'],
+    'monday': [1, 0], 'tuesday': [1, 0], 'wednesday': [1, 0], 'thursday': [1, 0], 'friday': [1, 0],
+    'saturday': [0, 1], 'sunday': [0, 1],
+    'start_date': [20250101, 20250101],
+    'end_date': [20251213, 20251213],
+})
+CALENDAR_DATES = pd.DataFrame({
+    'service_id': ['WD', 'WE'],
+    'date': [20250501, 20250501],
+    'exception_type': [2, 1],
+})
+
+
+@pytest.fixture(scope='module')
+def scan():
+    return ConnectionScan(STOP_TIMES, TRIPS, STOPS, ROUTES, service_ids={'WD'})
+
+
+def test_connections_only_include_active_services(scan):
+    assert scan.connection_count == 3
+    assert 't3' not in scan.trip_ids
+
+
+def test_footpaths_link_nearby_stops_only(scan):
+    c, d = scan.stop_index('C'), scan.stop_index('D')
+
+    assert [stop for stop, _ in scan.footpaths[d]] == [c]
+    assert 80 <= dict(scan.footpaths[c])[d] <= 100
+    assert scan.footpaths[scan.stop_index('E')] == []
+
+
+def test_last_arrival_is_latest_connection(scan):
+    assert scan.last_arrival == parse_time('08:20')
+
+
+def test_earliest_arrival_uses_transfer_walk(scan):
+    journey = scan.earliest_arrival('A', 'C', parse_time('08:00'))
+
+    assert journey['arrival'] == '08:09:33'
+    assert [(leg['mode'], leg.get('route')) for leg in journey['legs']] == [('ride', '2'), ('walk', None)]
+    assert journey['legs'][0]['departure'] == '08:02:00'
+
+
+def test_suspended_line_is_routed_around(scan):
+    journey = scan.earliest_arrival('A', 'C', parse_time('08:00'), suspended_routes=['2'])
+
+    assert journey['arrival'] == '08:20:00'
+    assert [leg['route'] for leg in journey['legs']] == ['1']
+
+
+def test_suspending_every_line_leaves_target_unreachable(scan):
+    assert scan.earliest_arrival('A', 'C', parse_time('08:00'), suspended_routes=['R1', '2']) is None
+
+
+def test_unknown_route_or_stop_is_rejected(scan):
+    with pytest.raises(KeyError):
+        scan.earliest_arrival('A', 'C', parse_time('08:00'), suspended_routes=['U9'])
+    with pytest.raises(KeyError):
+        scan.isochrone('Z', parse_time('08:00'))
+
+
+def test_missed_departure_is_not_boarded(scan):
+    assert scan.earliest_arrival('A', 'C', parse_time('08:05')) is None
+
+
+def test_time_budget_limits_earliest_arrival(scan):
+    assert scan.earliest_arrival('A', 'C', parse_time('08:00'), max_minutes=5) is None
+
+
+def test_isochrone_lists_stops_within_budget(scan):
+    reachable = {stop['stop_id']: stop['minutes'] for stop in scan.isochrone('A', parse_time('08:00'), max_minutes=15)}
+
+    assert reachable == {'A': 0.0, 'D': 8.0, 'C': 9.6, 'B': 10.0}
+
+
+def test_active_service_ids_applies_calendar_exceptions():
+    assert active_service_ids(CALENDAR, CALENDAR_DATES, date(2025, 4, 28)) == {'WD'}
+    assert active_service_ids(CALENDAR, CALENDAR_DATES, date(2025, 5, 3)) == {'WE'}
+    assert active_service_ids(CALENDAR, CALENDAR_DATES, date(2025, 5, 1)) == {'WE'}
+    assert active_service_ids(CALENDAR, CALENDAR_DATES, date(2026, 10, 19)) == set()
+
+
+def test_nearest_service_day_prefers_same_weekday():
+    day, services = nearest_service_day(CALENDAR, CALENDAR_DATES, date(2026, 10, 19))
+
+    assert day == date(2025, 12, 8)
+    assert day.weekday() == date(2026, 10, 19).weekday()
+    assert services == {'WD'}
+
+
+def test_nearest_service_day_without_services():
+    never = CALENDAR.assign(**{weekday: 0 for weekday in WEEKDAYS})
+
+    assert nearest_service_day(never, CALENDAR_DATES.iloc[:0], date(2025, 6, 2)) == (None, set())
+
+
+def test_parse_time_allows_service_after_midnight():
+    assert parse_time('25:10') == 25 * 3600 + 600
+    with pytest.raises(ValueError):
+        parse_time('8h')